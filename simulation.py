@@ -1,9 +1,23 @@
+import os
+import sys
 import simpy
 import math
-import random
 import numpy as np
 from datetime import timedelta
+from multiprocessing import Pool, get_all_start_methods, get_start_method
 from enum import IntEnum
+from heapq import heapify, heappop, heappush
+
+try:
+    from numba import njit
+    HAVE_NUMBA = True
+except ImportError:
+    # Numba isn't available on every interpreter (e.g. PyPy). The vectorised simulator is far too slow without it,
+    # so the SimPy model is used instead - this decorator only keeps the module importable
+    HAVE_NUMBA = False
+
+    def njit(*args, **kwargs):
+        return lambda function: function
 
 """
 === MOSEL VARIABLES ===
@@ -27,6 +41,9 @@ TIME_BLOCKS = 68  # Between 6am and 11pm
 SIMULATION_RUNTIME = TIME_BLOCKS * TIME_BLOCK_LENGTH  # Seconds
 TIME_BETWEEN_QUEUE_RECORDINGS = 60  # How many seconds in between each queue length recording?
 SIMULATIONS = 1  # Number of simulation runs to perform
+QUEUE_RECORDINGS = SIMULATION_RUNTIME // TIME_BETWEEN_QUEUE_RECORDINGS  # Queue length recordings per run
+# Run the SimPy discrete-event model instead of the vectorised simulator, which relies on Numba
+USE_SIMPY = not HAVE_NUMBA
 
 """
 === UTILITY FUNCTIONS/CLASSES ===
@@ -47,30 +64,48 @@ class TransactionType(IntEnum):
     RELOAD = 1
 
 
-def get_time_block(env):
-    """Returns the current time block between [0, TIME_BLOCKS)"""
-    return math.floor(env.now / TIME_BLOCK_LENGTH)
+def get_set_bits(mask):
+    """Returns the indexes of the bits set in an integer bitmask, lowest first"""
+    idx = []
+    while mask:
+        idx.append((mask & -mask).bit_length() - 1)
+        mask &= mask - 1
+    return idx
 
 
-def calculate_arrival_rate(time_block_demand):
-    """Calculates the customer arrival rate per second for the given time block"""
-    return (time_block_demand * 60) / 54000
+def get_hourly_queue_lengths(avg_queue_lengths):
+    """
+    Takes the average queue length at every recording and returns, for each time block, the average queue length
+    over the hour starting at that time block
+    """
+    recordings_per_hour = 60 * 60 // TIME_BETWEEN_QUEUE_RECORDINGS
+    blocks_per_hour = 60 * 60 // TIME_BLOCK_LENGTH
+    block_totals = np.concatenate(([0], np.cumsum(avg_queue_lengths.reshape(TIME_BLOCKS, -1).sum(axis=1))))
+    hour_end = np.minimum(np.arange(TIME_BLOCKS) + blocks_per_hour, TIME_BLOCKS)
+    return (block_totals[hour_end] - block_totals[:TIME_BLOCKS]) / recordings_per_hour
+
+
+def unpack_mosel_array(mosel_array):
+    """Splits a Mosel array into a 2D array of its 1-indexed keys and a 1D array of its values"""
+    keys = np.array(list(mosel_array.keys()), dtype=np.int64)
+    values = np.fromiter(mosel_array.values(), dtype=np.float64, count=len(mosel_array))
+    return keys, values
 
 
 def parse_staff_schedule(staff_schedule):
     """Translates the Mosel staff schedule into a 2D array in the format [collector_type, time_block]"""
+    keys, values = unpack_mosel_array(staff_schedule)
     staff = np.zeros((2, TIME_BLOCKS), dtype=int)
-    for collector, time_block in list(staff_schedule.keys()):
-        c = (collector - 1) % 2
-        staff[c, time_block - 1] += round(staff_schedule[collector, time_block])
+    # Static and mobile collectors of the same type are combined, hence add.at rather than assignment
+    np.add.at(staff, ((keys[:, 0] - 1) % 2, keys[:, 1] - 1), np.rint(values).astype(int))
     return staff
 
 
 def parse_customer_demand(demand):
     """Translates the Mosel demands into a 2D array in the format [transaction_type, time_block]"""
+    keys, values = unpack_mosel_array(demand)
     demands = np.zeros((2, TIME_BLOCKS), dtype=int)
-    for transaction_type, time_block in list(demand.keys()):
-        demands[transaction_type - 1, time_block - 1] = round(demand[transaction_type, time_block])
+    demands[keys[:, 0] - 1, keys[:, 1] - 1] = np.rint(values)
     return demands
 
 
@@ -79,7 +114,7 @@ def parse_customer_demand(demand):
 """
 
 
-class FareCollector(simpy.PriorityResource):
+class FareCollector(simpy.Resource):
     def __init__(self, env, capacity, idx, collector_type):
         self.env = env
         self.idx = idx
@@ -87,21 +122,20 @@ class FareCollector(simpy.PriorityResource):
         self.collector_type = collector_type
         super().__init__(env, capacity)
 
-    def sell_ticket(self, customer):
-        yield self.env.timeout(random.expovariate(1 / BUY_TICKET_TRANSACTION_TIME))
-
-    def reload_card(self, customer):
-        yield self.env.timeout(random.expovariate(1 / RELOAD_CARD_TRANSACTION_TIME))
-
     def get_queue_length(self):
         return len(self.queue) + len(self.users)
 
 
 class Station(object):
-    def __init__(self, env, schedule):
+    def __init__(self, env, schedule, rng):
         self.env = env
         self.schedule = schedule
+        self.rng = rng
         self.booth = []
+        self.current_block = 0  # Advanced by start_shift at the start of each time block
+        # Unit exponential draws that service times are scaled from, refilled a batch at a time
+        self.service_times = []
+        self.next_service_time = 0
         idx = 0
         # Add fare-collectors to the station booth
         for i in range(max(self.schedule[CollectorType.WITH_TERMINAL])):
@@ -116,13 +150,30 @@ class Station(object):
             )
             idx += 1
 
+        # Booth state is mirrored in bitmasks (bit i is fare-collector i) so nobody has to scan the booth
+        self.mask_with_terminal = 0
+        self.mask_on_shift = 0
+        for collector in self.booth:
+            if collector.collector_type is CollectorType.WITH_TERMINAL:
+                self.mask_with_terminal |= 1 << collector.idx
+        # Booth indexes of each type of fare-collector, in booth order
+        self.idx_by_type = {
+            collector_type: [x.idx for x in self.booth if x.collector_type is collector_type]
+            for collector_type in CollectorType
+        }
+        # Min-heaps of (queue length, idx) for the fare-collectors on shift [all, with terminal]. Entries are
+        # pushed whenever a queue changes and stale ones are discarded lazily when they reach the top
+        self.queue_heaps = ([], [])
+        # Queue length of every fare-collector at each recording in the format [collector, recording]
+        self.queue_lengths = np.zeros((len(self.booth), QUEUE_RECORDINGS), dtype=np.int32)
+
     def allocate_staff(self, collector_type):
         """Ensures the correct number of staff are on shift at the start of each time block"""
         on_shift = self.count_collectors_on_shift(collector_type)
-        required = on_shift - self.schedule[collector_type][get_time_block(self.env)]
+        required = on_shift - self.schedule[collector_type][self.current_block]
         if required > 0:
             # Too many staff are currently working, remove the required amount
-            self.env.process(self.remove_fare_collectors(required, collector_type))
+            self.remove_fare_collectors(required, collector_type)
         elif required < 0:
             #  Not enough staff working, add the required amount back in
             self.add_fare_collectors(abs(required), collector_type)
@@ -134,86 +185,351 @@ class Station(object):
             self.allocate_staff(CollectorType.WITHOUT_TERMINAL)
             # Wait the length of one time block
             yield self.env.timeout(TIME_BLOCK_LENGTH)
+            self.current_block += 1
 
     def remove_fare_collectors(self, num_to_remove, collector_type):
         """
-        To mimic the behaviour of removing staff, we request a fare-collector using a higher priority
-        than customers (-1). Once we have the fare-collector, we set it's on_shift boolean variable to False
-        which prevents other customers from requesting this fare collector until on_shift = True again
+        To mimic the behaviour of removing staff, we set the fare-collector's on_shift boolean variable to False
+        which prevents other customers from selecting this fare collector until on_shift = True again.
+        The customer being served is finished, while anyone still queueing leaves without being served
         """
-        on_shift = list(filter(lambda x: x.collector_type is collector_type and x.on_shift, self.booth))
-        for i in range(num_to_remove):
-            with on_shift[i].request(priority=-1) as request:
-                yield request
-                on_shift[i].on_shift = False
+        on_shift = [i for i in self.idx_by_type[collector_type] if self.booth[i].on_shift]
+        for i in on_shift[:num_to_remove]:
+            self.set_on_shift(self.booth[i], False)
 
     def add_fare_collectors(self, num_to_add, collector_type):
-        """When we need more fare-collectors, request one and change their on_shift boolean to True"""
-        on_shift = list(filter(lambda x: x.collector_type is collector_type and not x.on_shift, self.booth))
-        for x in range(num_to_add):
-            on_shift[x].on_shift = True
+        """
+        When we need more fare-collectors, change their on_shift boolean to True. Fare-collectors that have
+        finished serving their last customer are brought back first
+        """
+        off_shift = [i for i in self.idx_by_type[collector_type] if not self.booth[i].on_shift]
+        off_shift = [i for i in off_shift if not self.booth[i].count] + [i for i in off_shift if self.booth[i].count]
+        for i in off_shift[:num_to_add]:
+            self.set_on_shift(self.booth[i], True)
+
+    def set_on_shift(self, fare_collector, on_shift):
+        """Starts or ends a fare-collector's shift"""
+        fare_collector.on_shift = on_shift
+        if on_shift:
+            self.mask_on_shift |= 1 << fare_collector.idx
+        else:
+            self.mask_on_shift &= ~(1 << fare_collector.idx)
+        self.update_queue_length(fare_collector)
+
+    def draw_service_time(self, mean_service_time):
+        """Returns an exponentially distributed service time with the given mean"""
+        if self.next_service_time == len(self.service_times):
+            self.service_times = self.rng.exponential(size=4096).tolist()
+            self.next_service_time = 0
+        service_time = self.service_times[self.next_service_time] * mean_service_time
+        self.next_service_time += 1
+        return service_time
+
+    def update_queue_length(self, fare_collector):
+        """Pushes the fare-collector's current queue length onto the shortest queue heaps"""
+        if not fare_collector.on_shift:
+            return
+        if len(self.queue_heaps[0]) > 16 * len(self.booth):
+            self.rebuild_queue_heaps()
+        entry = (fare_collector.get_queue_length(), fare_collector.idx)
+        heappush(self.queue_heaps[0], entry)
+        if fare_collector.collector_type is CollectorType.WITH_TERMINAL:
+            heappush(self.queue_heaps[1], entry)
+
+    def rebuild_queue_heaps(self):
+        """Drops every stale entry from the shortest queue heaps so they don't keep growing"""
+        for heap, mask in zip(self.queue_heaps, (self.mask_on_shift, self.mask_on_shift & self.mask_with_terminal)):
+            heap[:] = [(self.booth[i].get_queue_length(), i) for i in get_set_bits(mask)]
+            heapify(heap)
+
+    def get_shortest_queue(self, transaction_type):
+        """
+        Customers always select the fare-collector with the shortest queue, ties going to the lowest index.
+        Returns the on shift fare-collector with the shortest queue that can serve the given transaction type
+        """
+        # Customers reloading their prepaid card need a fare-collector with a terminal
+        heap = self.queue_heaps[transaction_type is TransactionType.RELOAD]
+        while True:
+            queue_length, idx = heap[0]
+            fare_collector = self.booth[idx]
+            if fare_collector.on_shift and fare_collector.get_queue_length() == queue_length:
+                return fare_collector
+            heappop(heap)
 
     def count_collectors_on_shift(self, collector_type):
         """Returns the number of collectors of a given type that are currently on shift"""
-        return len([x for x in self.booth if x.collector_type is collector_type and x.on_shift])
-
-    def get_fare_collectors_on_shift(self):
-        """Return the fare-collector instances that currently on shift"""
-        return list(filter(lambda x: x.on_shift, self.booth))
-
-
-def select_fare_collector(station, transaction_type):
-    """Customers always select the fare-collector with the shortest queue. Return the selected fare-collector"""
-    # Get all fare collectors currently on shift
-    on_shift = station.get_fare_collectors_on_shift()
-    if transaction_type is TransactionType.RELOAD:
-        # Customer is reloading their prepaid card, therefore the fare-collector must have a terminal
-        # Filter out staff that don't have a terminal
-        on_shift = list(filter(lambda x: x.collector_type is CollectorType.WITH_TERMINAL, on_shift))
-    queue_lengths = list(map(lambda x: x.get_queue_length(), on_shift))
-    return on_shift[queue_lengths.index(min(queue_lengths))]
+        if collector_type is CollectorType.WITH_TERMINAL:
+            mask = self.mask_with_terminal
+        else:
+            mask = ~self.mask_with_terminal
+        return bin(self.mask_on_shift & mask).count("1")
 
 
 def go_to_station(env, customer, station, transaction_type):
-    """This function imitates a customer arriving at the station, selecting a fare-collector and queueing"""
-    fare_collector = select_fare_collector(station, transaction_type)
+    """
+    This function imitates a customer arriving at the station, selecting a fare-collector, queueing and then
+    buying a ticket or reloading their prepaid card
+    """
+    fare_collector = station.get_shortest_queue(transaction_type)
     with fare_collector.request() as request:
+        station.update_queue_length(fare_collector)
         yield request
+        # The service time is yielded directly rather than through a separate process for each customer
         if transaction_type is TransactionType.RELOAD and fare_collector.on_shift:
-            yield env.process(fare_collector.reload_card(customer))
+            yield env.timeout(station.draw_service_time(RELOAD_CARD_TRANSACTION_TIME))
         elif transaction_type is TransactionType.BUY and fare_collector.on_shift:
-            yield env.process(fare_collector.sell_ticket(customer))
+            yield env.timeout(station.draw_service_time(BUY_TICKET_TRANSACTION_TIME))
+    station.update_queue_length(fare_collector)
 
 
-def simulate_customers(env, station, demands, transaction_type):
-    """Customers with odd indexes are buying tickets, even are reloading prepaid cards"""
-    customer_idx = 1 if transaction_type is TransactionType.BUY else 2
+def simulate_customers(env, station, arrival_rates, rng):
+    """
+    Customers of both transaction types arrive as one stream at the combined arrival rate, each one buying a
+    ticket with probability equal to the share of ticket demand in the time block.
+    Customers with odd indexes are buying tickets, even are reloading prepaid cards
+    """
+    customer_idx = [1, 2]  # Next customer index for [buy, reload]
+    time_block = None
+    time_between_customers = []
+    buying_ticket = []
+    next_customer = 0
     while True:
-        arrivals_per_second = calculate_arrival_rate(demands[get_time_block(env)])
-        time_between_customers = round(random.expovariate(arrivals_per_second))
-        yield env.timeout(time_between_customers)
-        env.process(go_to_station(env, customer_idx, station, transaction_type))
-        customer_idx += 2
+        if time_block != station.current_block or next_customer == len(time_between_customers):
+            time_block = station.current_block
+            buy_rate = arrival_rates[TransactionType.BUY][time_block]
+            arrivals_per_second = buy_rate + arrival_rates[TransactionType.RELOAD][time_block]
+            if arrivals_per_second == 0:
+                # Nobody arrives during this time block, wait for the next one
+                yield env.timeout((time_block + 1) * TIME_BLOCK_LENGTH - env.now)
+                continue
+            # Draw the interarrival times and transaction types for the time block in one go, with room to spare
+            size = int(arrivals_per_second * TIME_BLOCK_LENGTH * 3) + 16
+            time_between_customers = rng.exponential(1 / arrivals_per_second, size=size).tolist()
+            buying_ticket = (rng.random(size) < buy_rate / arrivals_per_second).tolist()
+            next_customer = 0
+        yield env.timeout(time_between_customers[next_customer])
+        transaction_type = TransactionType.BUY if buying_ticket[next_customer] else TransactionType.RELOAD
+        next_customer += 1
+        env.process(go_to_station(env, customer_idx[transaction_type], station, transaction_type))
+        customer_idx[transaction_type] += 2
+
+
+def record_queue_lengths(env, station):
+    """Every minute, record the length of the queue for each fare_collector on shift"""
+    booth = station.booth
+    # Recordings are evenly spaced, so the recording index is simply counted rather than derived from env.now
+    for recording in range(QUEUE_RECORDINGS):
+        station.queue_lengths[:, recording] = np.fromiter(
+            (x.get_queue_length() if x.on_shift else 0 for x in booth), dtype=np.int32, count=len(booth)
+        )
+        yield env.timeout(TIME_BETWEEN_QUEUE_RECORDINGS)
 
 
-def record_queue_lengths(env, station, queue_lengths):
-    """Every minute, record the length of the queue for each fare_collector on shift"""
-    while True:
-        queue = []
-        on_shift = 0
-        for collector in station.booth:
-            if collector.on_shift:
-                queue.append(collector.get_queue_length())
-                on_shift += 1
-
-        avg_queue_len = (sum(queue) / on_shift) / 60
-        time_block = get_time_block(env)
-        for t in range(time_block, time_block - 4, -1):
-            if t < 0:
-                break
-            queue_lengths[t] += avg_queue_len
+def run_simpy_simulation(rng, staff_levels, arrival_rates):
+    """Runs the SimPy discrete-event model once and returns the rolling hour average queue length per time block"""
+    # Initialise simulation environment
+    env = simpy.Environment()
+    station = Station(env, staff_levels, rng)
+    # Allocate staff
+    env.process(station.start_shift())
+    # Start Recording queue length
+    env.process(record_queue_lengths(env, station))
+    # Start simulating customers buying tickets and reloading prepaid cards
+    env.process(simulate_customers(env, station, arrival_rates, rng))
 
-        yield env.timeout(TIME_BETWEEN_QUEUE_RECORDINGS)
+    env.run(until=SIMULATION_RUNTIME)
+
+    # Average queue length of the fare-collectors on shift at each recording
+    on_shift = np.repeat(staff_levels.sum(axis=0), TIME_BLOCK_LENGTH // TIME_BETWEEN_QUEUE_RECORDINGS)
+    return get_hourly_queue_lengths(station.queue_lengths.sum(axis=0) / on_shift)
+
+
+"""
+=== VECTORISED SIMULATION ===
+"""
+
+
+def get_shift_masks(staff_levels):
+    """
+    Returns the collector type of each fare-collector in the booth and a boolean array in the format
+    [time_block, collector] marking who is on shift. Staff are added and removed in the same order as
+    Station.allocate_staff so both models share the same booth layout
+    """
+    collector_types = np.repeat([CollectorType.WITH_TERMINAL, CollectorType.WITHOUT_TERMINAL],
+                                staff_levels.max(axis=1))
+    on_shift = np.zeros(len(collector_types), dtype=bool)
+    shift_masks = np.zeros((TIME_BLOCKS, len(collector_types)), dtype=bool)
+    for t in range(TIME_BLOCKS):
+        for collector_type in CollectorType:
+            idx = np.flatnonzero(collector_types == collector_type)
+            required = staff_levels[collector_type, t] - np.count_nonzero(on_shift[idx])
+            if required > 0:
+                on_shift[idx[~on_shift[idx]][:required]] = True
+            elif required < 0:
+                on_shift[idx[on_shift[idx]][:-required]] = False
+        shift_masks[t] = on_shift
+    return collector_types, shift_masks
+
+
+def generate_arrivals(rng, arrival_rates):
+    """
+    Pre-draws the arrival time and transaction type of every customer in the run, sorted by arrival time.
+    Unit-rate exponential interarrival times are mapped through the cumulative demand, giving Poisson
+    arrivals at each time block's own rate
+    """
+    block_edges = np.arange(TIME_BLOCKS + 1) * TIME_BLOCK_LENGTH
+    arrival_times = []
+    transaction_types = []
+    for transaction_type in TransactionType:
+        arrivals_per_block = arrival_rates[transaction_type] * TIME_BLOCK_LENGTH
+        cumulative_demand = np.concatenate(([0], np.cumsum(arrivals_per_block)))
+        expected = cumulative_demand[-1]
+        # Draw a few standard deviations more than expected so a second draw is rarely needed
+        arrivals = np.cumsum(rng.exponential(size=int(expected + 5 * math.sqrt(expected)) + 16))
+        while arrivals[-1] < expected:
+            arrivals = np.concatenate((arrivals, arrivals[-1] + np.cumsum(rng.exponential(size=16))))
+        arrivals = arrivals[arrivals < expected]
+        arrival_times.append(np.interp(arrivals, cumulative_demand, block_edges))
+        transaction_types.append(np.full(len(arrivals), transaction_type, dtype=np.int8))
+
+    arrival_times = np.concatenate(arrival_times)
+    order = np.argsort(arrival_times, kind='stable')
+    return arrival_times[order], np.concatenate(transaction_types)[order]
+
+
+@njit(cache=True, fastmath=True)
+def assign_customers(arrival_times, transaction_types, service_times, collector_types, shift_masks):
+    """
+    Every customer joins the shortest queue among the on-shift fare-collectors able to serve them.
+    Returns the fare-collector selected by, and the departure time of, each customer.
+
+    Each fare-collector's queue is a linked list of customer indexes. When a fare-collector leaves their
+    shift, the customer being served is finished and anyone still waiting leaves the queue at the same time,
+    which is how the SimPy model behaves.
+
+    This loop visits every customer, so it is compiled with Numba. The compiled function is cached on disk so
+    that repeated Mosel iterations only pay the compilation cost once.
+    """
+    num_customers = len(arrival_times)
+    num_collectors = len(collector_types)
+    collectors = np.empty(num_customers, dtype=np.int64)
+    departures = np.empty(num_customers, dtype=np.float64)
+    next_in_queue = np.full(num_customers, -1, dtype=np.int64)
+    queue_head = np.full(num_collectors, -1, dtype=np.int64)
+    queue_tail = np.full(num_collectors, -1, dtype=np.int64)
+    queue_length = np.zeros(num_collectors, dtype=np.int64)
+    next_free = np.zeros(num_collectors, dtype=np.float64)
+
+    i = 0
+    for t in range(TIME_BLOCKS):
+        block_start = t * TIME_BLOCK_LENGTH
+        for c in range(num_collectors):
+            if t == 0 or not shift_masks[t - 1, c] or shift_masks[t, c]:
+                continue
+            # Fare-collector has left their shift - drop everyone behind the customer being served
+            head = queue_head[c]
+            while head != -1 and departures[head] <= block_start:
+                head = next_in_queue[head]
+            if head == -1:
+                queue_head[c] = -1
+                queue_tail[c] = -1
+                queue_length[c] = 0
+                continue
+            waiting = next_in_queue[head]
+            while waiting != -1:
+                departures[waiting] = departures[head]
+                waiting = next_in_queue[waiting]
+            next_in_queue[head] = -1
+            queue_head[c] = head
+            queue_tail[c] = head
+            queue_length[c] = 1
+            next_free[c] = departures[head]
+
+        block_end = block_start + TIME_BLOCK_LENGTH
+        while i < num_customers and arrival_times[i] < block_end:
+            now = arrival_times[i]
+            selected = -1
+            for c in range(num_collectors):
+                if not shift_masks[t, c]:
+                    continue
+                if transaction_types[i] == TransactionType.RELOAD and \
+                        collector_types[c] != CollectorType.WITH_TERMINAL:
+                    continue
+                # Customers that have been served leave the queue
+                head = queue_head[c]
+                while head != -1 and departures[head] <= now:
+                    head = next_in_queue[head]
+                    queue_length[c] -= 1
+                queue_head[c] = head
+                if head == -1:
+                    queue_tail[c] = -1
+                if selected == -1 or queue_length[c] < queue_length[selected]:
+                    selected = c
+            if selected == -1:
+                raise ValueError("No fare-collector on shift can serve the customer")
+
+            collectors[i] = selected
+            departures[i] = max(now, next_free[selected]) + service_times[i]
+            next_free[selected] = departures[i]
+            if queue_tail[selected] == -1:
+                queue_head[selected] = i
+            else:
+                next_in_queue[queue_tail[selected]] = i
+            queue_tail[selected] = i
+            queue_length[selected] += 1
+            i += 1
+
+    return collectors, departures
+
+
+def count_queue_lengths(num_collectors, collectors, arrival_times, departures):
+    """Returns the queue length of each fare-collector at every recording in the format [collector, recording]"""
+    # A customer is counted by every recording made between their arrival and departure
+    first = np.ceil(arrival_times / TIME_BETWEEN_QUEUE_RECORDINGS).astype(np.int64)
+    last = np.ceil(departures / TIME_BETWEEN_QUEUE_RECORDINGS).astype(np.int64)
+    changes = np.zeros((num_collectors, QUEUE_RECORDINGS + 1), dtype=np.int32)
+    np.add.at(changes, (collectors, np.minimum(first, QUEUE_RECORDINGS)), 1)
+    np.add.at(changes, (collectors, np.minimum(last, QUEUE_RECORDINGS)), -1)
+    return np.cumsum(changes, axis=1)[:, :QUEUE_RECORDINGS]
+
+
+def run_vectorised_simulation(rng, staff_levels, arrival_rates):
+    """Runs the vectorised model once and returns the rolling hour average queue length per time block"""
+    collector_types, shift_masks = get_shift_masks(staff_levels)
+    arrival_times, transaction_types = generate_arrivals(rng, arrival_rates)
+    service_times = rng.exponential(
+        np.where(transaction_types == TransactionType.RELOAD, RELOAD_CARD_TRANSACTION_TIME,
+                 BUY_TICKET_TRANSACTION_TIME)
+    )
+    collectors, departures = assign_customers(arrival_times, transaction_types, service_times, collector_types,
+                                              shift_masks)
+    queue_lengths = count_queue_lengths(len(collector_types), collectors, arrival_times, departures)
+
+    # Average queue length of the fare-collectors on shift at each recording
+    recordings_per_block = TIME_BLOCK_LENGTH // TIME_BETWEEN_QUEUE_RECORDINGS
+    on_shift = np.repeat(shift_masks, recordings_per_block, axis=0).T
+    return get_hourly_queue_lengths((queue_lengths * on_shift).sum(axis=0) / on_shift.sum(axis=0))
+
+
+def can_start_worker_processes():
+    """
+    Worker processes started with spawn (the only option on Windows) re-import __main__ from its file. When Mosel
+    runs this script through pyrun there may be no such file, and the pool hangs, so only fork is safe then
+    """
+    # allow_none avoids fixing the start method, which Mosel may still set on a later pyrun
+    start_method = get_start_method(allow_none=True) or get_all_start_methods()[0]
+    if start_method == 'fork':
+        return True
+    main_file = getattr(sys.modules['__main__'], '__file__', None)
+    return main_file is not None and os.path.isfile(main_file)
+
+
+def run_simulation(seed, staff_levels, arrival_rates):
+    """Performs one independent simulation run seeded from the given SeedSequence"""
+    rng = np.random.default_rng(seed)
+    if USE_SIMPY:
+        return run_simpy_simulation(rng, staff_levels, arrival_rates)
+    return run_vectorised_simulation(rng, staff_levels, arrival_rates)
 
 
 def start_simulation():
@@ -226,48 +542,40 @@ def start_simulation():
 
     staff_levels = parse_staff_schedule(schedule)
     demands = parse_customer_demand(D)
-
-    # Holds the running average of the avg queue length in each time block
-    avg_queue_lengths = [0] * TIME_BLOCKS
+    # Customer arrival rate per second in the format [transaction_type, time_block]
+    arrival_rates = (demands * 60) / 54000
 
     # Start simulation
-    for i in range(SIMULATIONS):
-        if VERBOSE:
-            print(f"+ Starting simulation...")
-            print(f"--- Run {i + 1} of {SIMULATIONS} Completed")
-
-        # Initialise simulation environment
-        env = simpy.Environment()
-        station = Station(env, staff_levels)
-        # Allocate staff
-        env.process(station.start_shift())
-        # Start Recording queue length
-        queue_lengths = [0] * TIME_BLOCKS
-        env.process(record_queue_lengths(env, station, queue_lengths))
-        # Start simulating customers with prepaid cards
-        env.process(simulate_customers(env, station, demands[TransactionType.RELOAD], TransactionType.RELOAD))
-        # Start simulating customers buying tickets
-        env.process(simulate_customers(env, station, demands[TransactionType.BUY], TransactionType.BUY))
-
-        env.run(until=SIMULATION_RUNTIME)
-        for t in range(TIME_BLOCKS):
-            avg_queue_lengths[t] += queue_lengths[t] / SIMULATIONS
+    if VERBOSE:
+        print(f"+ Starting simulation...")
+    seeds = np.random.SeedSequence().spawn(SIMULATIONS)
+    if SIMULATIONS > 1 and can_start_worker_processes():
+        # Runs are independent of each other, so they are spread across worker processes
+        with Pool(processes=min(SIMULATIONS, os.cpu_count() or 1)) as pool:
+            results = pool.starmap(run_simulation, [(seed, staff_levels, arrival_rates) for seed in seeds])
+    else:
+        results = [run_simulation(seed, staff_levels, arrival_rates) for seed in seeds]
+    if VERBOSE:
+        print(f"--- {SIMULATIONS} of {SIMULATIONS} Runs Completed")
+
+    # Holds the average of the avg queue length in each time block across all runs
+    avg_queue_lengths = np.mean(results, axis=0)
 
     complete = 1
     # Check if service standard has been violated in any time blocks
-    for t in range(TIME_BLOCKS):
-        if avg_queue_lengths[t] >= SERVICE_STANDARD + 1:
-            # Service standard violated - add an extra member of staff
-            # t+1 because V is from Mosel indexed from 1 instead of 0
-            on_shift = int(staff_levels[CollectorType.WITH_TERMINAL][t]) + int(
-                staff_levels[CollectorType.WITHOUT_TERMINAL][t])
-            V[t + 1] = on_shift + 1
-            complete = 0
-
-            if VERBOSE:
-                print(f"--- Time Block {t + 1} had an average queue length of: {round(avg_queue_lengths[t])}")
-                print(f"--- Increasing minimum staff from {on_shift} to {on_shift + 1}\n")
-            break
+    violated = np.flatnonzero(avg_queue_lengths >= SERVICE_STANDARD + 1)
+    if len(violated) > 0:
+        t = int(violated[0])
+        # Service standard violated - add an extra member of staff
+        # t+1 because V is from Mosel indexed from 1 instead of 0
+        on_shift = int(staff_levels[CollectorType.WITH_TERMINAL][t]) + int(
+            staff_levels[CollectorType.WITHOUT_TERMINAL][t])
+        V[t + 1] = on_shift + 1
+        complete = 0
+
+        if VERBOSE:
+            print(f"--- Time Block {t + 1} had an average queue length of: {round(avg_queue_lengths[t])}")
+            print(f"--- Increasing minimum staff from {on_shift} to {on_shift + 1}\n")
 
     if complete == 1:
         # Optimisation-Simulation complete